@@ -1,7 +1,52 @@
+import itertools
 import json
 import os
 import logging
 import sys
+import threading
+import time
+from collections import OrderedDict
+import ijson
+
+# Read buffer used when streaming JSON responses through ijson
+STREAM_CHUNK_SIZE = 65536
+
+
+def stream_json_items(response, prefix):
+    """
+        Yields the objects found at an ijson prefix (i.e.
+        'collections.item.metadataEntries') of a streamed httpx response,
+        without building the whole JSON document.
+    """
+    # Push the response chunks into ijson as they arrive
+    items = ijson.sendable_list()
+    coro = ijson.items_coro(items, prefix, use_float=True)
+    chunks = response.iter_bytes(STREAM_CHUNK_SIZE)
+    try:
+        for chunk in chunks:
+            coro.send(chunk)
+            yield from items
+            del items[:]
+        coro.close()
+        yield from items
+    finally:
+        # Read (without parsing) what is left of the body when the caller
+        # stops early, otherwise the connection cannot be reused
+        for _ in chunks:
+            pass
+
+
+def first_json_item(response, prefix):
+    """
+        Returns the first object found at an ijson-style prefix of a streamed
+        httpx response, or None if there is none. The rest of the body is
+        drained so the connection goes back to the pool.
+    """
+    items = stream_json_items(response, prefix)
+    try:
+        return next(items, None)
+    finally:
+        items.close()
 
 
 class DMESession():
@@ -9,7 +54,7 @@ class DMESession():
     A utility class to perform Data Management Environment requests
     """
 
-    def __init__(self, dme_url = '', dme_token = ''):
+    def __init__(self, dme_url = '', dme_token = '', cache_ttl = 300, cache_size = 1024):
         """
         Constructor
         Parameters
@@ -18,13 +63,74 @@ class DMESession():
             URL to perform the requests
         dme_token : string
             User token
+        cache_ttl : float
+            Seconds a fetched metadata dictionary is reused before
+            requesting it again from DME
+        cache_size : int
+            Maximum number of metadata dictionaries kept in memory
         """
         self.dme_utils = 'HPC_DM_UTILS'
         self.dme_url = dme_url if dme_url != '' else self.get_dme_url()
         self.dme_token = dme_token if dme_token != '' else self.get_token_from_file()
-        import requests
-        from requests.packages.urllib3.exceptions import InsecureRequestWarning
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+        import httpx
+        # Single keep-alive client shared by all requests (and threads), the
+        # concurrent requests are multiplexed over one HTTP/2 connection
+        self._client = httpx.Client(
+            http2=True,
+            verify=False,
+            headers={"Authorization": "Bearer {0}".format(self.dme_token)},
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+            timeout=30.0
+        )
+        # LRU of (expiry, metadata) keyed by (kind, path, in_pairs)
+        self._cache = OrderedDict()
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    def _cache_get(self, key):
+        """
+            Returns the cached value for key, or None if it is missing or
+            has expired
+        """
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() > entry[0]:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _cache_set(self, key, value):
+        """
+            Stores value for key, evicting the least recently used entry when
+            the cache is full. Empty responses (missing paths) are not cached.
+        """
+        if len(value) == 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + self._cache_ttl, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, path=None):
+        """
+            Drops the cached metadata of a DME path, or the whole cache if no
+            path is given. Must be called after writing metadata to DME.
+            Parameters
+            ----------
+            path : string
+                The path of the collection or data object on DME
+        """
+        with self._cache_lock:
+            if path is None:
+                self._cache.clear()
+                return
+            for key in [key for key in self._cache if key[1] == path]:
+                del self._cache[key]
     
     def get_dme_url(self):
         """
@@ -44,13 +150,12 @@ class DMESession():
             sys.exit(1)
         
         properties = f"{hpc_utils}/hpcdme.properties"
-        f = open(properties,'r')
         url = ''
-        for l in f.readlines():
-            if (l[0] == '#'):
-                continue
-            if 'hpc.server.url' in l:
-                url = l.split('=')[1][0:-1]
+        with open(properties,'r') as f:
+            for l in f:
+                if l.startswith('#') or 'hpc.server.url' not in l:
+                    continue
+                url = l.partition('=')[2].strip()
                 break
         #if "fsdmel-dsapi01t.ncifcrf.gov" in url:
         #    url = url.replace("/hpc-server","")
@@ -82,10 +187,10 @@ class DMESession():
             print(f"ERROR: could not open token file. Exiting...")
             sys.exit(1)
 
-        lines = [l for l in token_file]
-        token = lines[1].split('Bearer ')[1][0:-2]
-        token_file.close()
-        del lines
+        # The token is in the second line, the rest of the file is not read
+        with token_file:
+            line = next(itertools.islice(token_file, 1, 2))
+        token = line.split('Bearer ')[1][0:-2]
         return token
     
     def list_files(self, dir_path, print_dataObjects=False):
@@ -105,31 +210,66 @@ class DMESession():
         """
 
         # data_object_path = encode_path(data_object_path)
-        dme_token = self.dme_token
-        headers = {}
-        headers["Authorization"] = "Bearer {0}".format(dme_token)
         full_path = self.dme_url + "/collection/" + dir_path
         params = {"list":"true"}
         
-        import requests
-        get_response = requests.get(full_path, headers=headers, verify=False, params=params)
-        if get_response.status_code != 200:
-            logging.error("Error getting DME directory", dir_path)
-            raise Exception("Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text))
-        
-        metadata_dic = json.loads(get_response.text)
-        dataObjects = metadata_dic['collections'][0]['collection']['dataObjects']
-        if print_dataObjects:
-            print(json.dumps(metadata_dic['collections'][0]['collection']['dataObjects'], indent=2, separators=(", ", " = ")))
+        with self._client.stream("GET", full_path, params=params) as get_response:
+            if get_response.status_code != 200:
+                get_response.read()
+                logging.error("Error getting DME directory", dir_path)
+                raise Exception("Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text))
 
-        files = []
-        for dataObject in dataObjects:
-            files.append(dataObject['path'])
-        return files
+            dataObjects = stream_json_items(get_response, 'collections.item.collection.dataObjects.item')
+            # Only serialize the data objects when they are going to be shown
+            if print_dataObjects or logging.getLogger().isEnabledFor(logging.DEBUG):
+                dataObjects = list(dataObjects)
+                dump = json.dumps(dataObjects, indent=2, separators=(", ", " = "))
+                if print_dataObjects:
+                    print(dump)
+                else:
+                    logging.debug(dump)
+
+            return [dataObject['path'] for dataObject in dataObjects]
+
+    def get_collection_dme_meta(self, collection_path, in_pairs=True, return_error=False):
+        """
+            Return the self metadata values for a collection. Results are
+            cached for cache_ttl seconds and must not be modified.
+            Parameters
+            ----------
+            collection_path : string
+                The path of the file on DME 
+            in_pairs : boolean
+                Return a dictionary with key pairs if True, otherwise return
+                the dictionary as it comes from DME
+  
+            return_error : boolean
+                Also return the error message of a failed request if True,
+                instead of printing it
+  
+            Returns
+            ----------
+            dictionary
+                Dictonary of all metadata for the file in DME, empty if the
+                request failed
+            error : string
+                Only if return_error is True, the error message of a failed
+                request or an empty string
+        """
+        key = ('collection', collection_path, in_pairs)
+        meta, error = self._cache_get(key), ''
+        if meta is None:
+            meta, error = self._fetch_collection_dme_meta(collection_path, in_pairs)
+            self._cache_set(key, meta)
+        if return_error:
+            return meta, error
+        if error:
+            print(error)
+        return meta
 
-    def get_collection_dme_meta(self, collection_path, in_pairs=True):
+    def _fetch_collection_dme_meta(self, collection_path, in_pairs=True):
         """
-            Return the self metadata values for a collection
+            Request the self metadata values for a collection from DME
             Parameters
             ----------
             collection_path : string
@@ -141,42 +281,79 @@ class DMESession():
             Returns
             ----------
             dictionary
-                Dictonary of all metadata for the file in DME 
+                Dictonary of all metadata for the file in DME, empty if the
+                request failed
+            error : string
+                Error message of a failed request or an empty string
         """
         # data_object_path = encode_path(data_object_path)
-        dme_token = self.dme_token
-        headers = {}
-        headers["Authorization"] = "Bearer {0}".format(dme_token)
-        import requests
         full_path = self.dme_url + "/collection" + collection_path
         
-        get_response = requests.get(full_path, headers=headers, verify=False)
-        if get_response.status_code != 200:
-            #logging.error("Error accessing collection on DME", collection_path)
-            print("Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text))
-            return {}
-            #raise Exception("Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text))    
-  
-        metadata_dic = json.loads(get_response.text)
-        #print(json.dumps(metadata_dic, indent=2, separators=(", ", " = ")))
+        with self._client.stream("GET", full_path) as get_response:
+            if get_response.status_code != 200:
+                get_response.read()
+                #logging.error("Error accessing collection on DME", collection_path)
+                return {}, "Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text)
+                #raise Exception("Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text))    
+
+            # Only the metadata entries of the first collection are parsed
+            metadata_entries = first_json_item(get_response, 'collections.item.metadataEntries')
+            if metadata_entries is None:
+                return {}, "Response code: {0}, Response message: no collection metadata found for {1}".format(get_response.status_code, collection_path)
 
         if not in_pairs:
-            self_metadata = metadata_dic['collections'][0]['metadataEntries']
+            self_metadata = metadata_entries
             self_metadata['metadataEntries'] = self_metadata['selfMetadataEntries']
             keys = [key for key in self_metadata.keys() if key != 'metadataEntries']
             for key in keys:
                 del self_metadata[key]
-            return self_metadata
+            return self_metadata, ''
         
-        self_metadata = metadata_dic['collections'][0]['metadataEntries']['selfMetadataEntries']
+        self_metadata = metadata_entries['selfMetadataEntries']
         self_dic = {}
         for pair in self_metadata:
             self_dic[pair['attribute']] = pair['value']
-        return self_dic
+        return self_dic, ''
+
+    def get_dataObject_dme_meta(self, data_object_path, in_pairs=True, return_error=False):
+        """
+            Return the self metadata values for a file (data_object). Results
+            are cached for cache_ttl seconds and must not be modified.
+            Parameters
+            ----------
+            data_object_path : string
+                The path of the file on DME 
+            in_pairs : boolean
+                Return a dictionary with key pairs if True, otherwise return
+                the dictionary as it comes from DME
+  
+            return_error : boolean
+                Also return the error message of a failed request if True,
+                instead of printing it
+  
+            Returns
+            ----------
+            dictionary
+                Dictonary of all metadata for the file in DME, empty if the
+                request failed
+            error : string
+                Only if return_error is True, the error message of a failed
+                request or an empty string
+        """
+        key = ('dataObject', data_object_path, in_pairs)
+        meta, error = self._cache_get(key), ''
+        if meta is None:
+            meta, error = self._fetch_dataObject_dme_meta(data_object_path, in_pairs)
+            self._cache_set(key, meta)
+        if return_error:
+            return meta, error
+        if error:
+            print(error)
+        return meta
 
-    def get_dataObject_dme_meta(self, data_object_path, in_pairs=True):
+    def _fetch_dataObject_dme_meta(self, data_object_path, in_pairs=True):
         """
-            Return the self metadata values for a file (data_object)
+            Request the self metadata values for a file (data_object) from DME
             Parameters
             ----------
             data_object_path : string
@@ -188,34 +365,36 @@ class DMESession():
             Returns
             ----------
             dictionary
-                Dictonary of all metadata for the file in DME 
+                Dictonary of all metadata for the file in DME, empty if the
+                request failed
+            error : string
+                Error message of a failed request or an empty string
         """
         # data_object_path = encode_path(data_object_path)
-        dme_token = self.dme_token
-        headers = {}
-        headers["Authorization"] = "Bearer {0}".format(dme_token)
-        import requests
         full_path = self.dme_url + "/v2/dataObject/" + data_object_path
-        get_response = requests.get(full_path, headers=headers, verify=False)
-        if get_response.status_code != 200:
-            #logging.error("Error accessing dataObject on DME", collection_path)
-            print("Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text))
-            return {}
-            #raise Exception("Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text)) 
-  
-        metadata_dic = json.loads(get_response.text)
+        with self._client.stream("GET", full_path) as get_response:
+            if get_response.status_code != 200:
+                get_response.read()
+                #logging.error("Error accessing dataObject on DME", collection_path)
+                return {}, "Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text)
+                #raise Exception("Response code: {0}, Response message: {1}".format(get_response.status_code, get_response.text)) 
+
+            # Only the first self metadata entry is parsed
+            self_entries = first_json_item(get_response, 'metadataEntries.selfMetadataEntries.item')
+            if self_entries is None:
+                return {}, "Response code: {0}, Response message: no dataObject metadata found for {1}".format(get_response.status_code, data_object_path)
 
         if not in_pairs:
-            self_metadata = metadata_dic['metadataEntries']['selfMetadataEntries'][0]
+            self_metadata = self_entries
             self_metadata['metadataEntries'] = self_metadata['userMetadataEntries']
             keys = [key for key in self_metadata.keys() if key != 'metadataEntries']
             for key in keys:
                 del self_metadata[key]
-            return self_metadata
+            return self_metadata, ''
 
-        self_metadata = metadata_dic['metadataEntries']['selfMetadataEntries'][0]['userMetadataEntries']
+        self_metadata = self_entries['userMetadataEntries']
         self_dic = {}
         for pair in self_metadata:
             self_dic[pair['attribute']] = pair['value']
  
-        return self_dic
+        return self_dic, ''
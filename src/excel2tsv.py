@@ -1,5 +1,7 @@
 from __future__ import print_function
-import pandas as pd
+import csv
+import itertools
+import os
 import sys
 
 
@@ -16,19 +18,69 @@ Example: Note 'huPlasma_36-plex.xlsx' contains two worksheets: Results and QC
     > test_Results.txt
     > test_QC.txt
 Requirements:
-   pandas
+   openpyxl
 '''
 
 
+def write_sheet(worksheet, filename):
+        '''Streams the rows of a worksheet (read-only mode) to a TSV file, parsing the worksheet only once. Formatted but
+        empty cells inflate the dimensions reported by the XLSX file, so the output is trimmed like pandas used to:
+        runs of empty rows are held back and only written when a non-empty row follows them, and the rightmost
+        non-empty column is tracked while streaming. If the rows turn out wider (or ragged), the written TSV is
+        trimmed (or padded) to that column afterwards, which is much cheaper than parsing the worksheet again.'''
+        tmpfile = filename + '.tmp'
+        ncols, width, uniform = 0, None, True
+        with open(tmpfile, 'w', encoding='utf-8', newline='') as outfile:
+                writer = csv.writer(outfile, delimiter='\t', lineterminator='\n')
+                empty_row, empty_rows = None, 0
+                for row in worksheet.iter_rows(values_only=True):
+                        if width is None:
+                                width = len(row)
+                        elif len(row) != width:
+                                uniform = False
+                        # Index of the last non-empty cell of the row
+                        n = len(row)
+                        while n > 0 and row[n-1] is None:
+                                n -= 1
+                        if n == 0:
+                                empty_row, empty_rows = row, empty_rows + 1
+                                continue
+                        ncols = max(ncols, n)
+                        if empty_rows > 0:
+                                writer.writerows(itertools.repeat(empty_row, empty_rows))
+                                empty_rows = 0
+                        writer.writerow(row)
+
+        if uniform and width == ncols:
+                os.replace(tmpfile, filename)
+                return
+        with open(tmpfile, 'r', encoding='utf-8', newline='') as infile, \
+                        open(filename, 'w', encoding='utf-8', newline='') as outfile:
+                writer = csv.writer(outfile, delimiter='\t', lineterminator='\n')
+                for row in csv.reader(infile, delimiter='\t'):
+                        writer.writerow(row[:ncols] + [''] * (ncols - len(row)))
+        os.remove(tmpfile)
+
+
+def sheet_filename(outprefix, sheet):
+        '''Returns the TSV filename of a worksheet.'''
+        return "{}_{}.txt".format(outprefix, sheet.replace(' ','-'))
+
+
 def write(inputfile, outprefix):
-        '''Takes input XLSX filename and output file prefix to create multiple TSV files for each worksheet in the XSLX file.'''
-        sheet2df = pd.read_excel(inputfile, sheet_name=None, header=None)
+        '''Takes input XLSX filename and output file prefix to create multiple TSV files for each worksheet in the XSLX file.
+        The workbook is opened once (read-only mode) and its worksheets are converted one after the other.'''
+        from openpyxl import load_workbook
+        wb = load_workbook(inputfile, read_only=True, data_only=True)
+        sheets = wb.sheetnames
 
         print('Found Worksheets:')
-        for sheet, data in sheet2df.items():
+        for sheet in sheets:
                 print(" - {}".format(sheet))
-                outfile =  sheet2df[sheet]
-                outfile.to_csv("{}_{}.txt".format(outprefix, sheet.replace(' ','-')),sep='\t',encoding='utf-8', header=None, index=False)
+
+        for sheet in sheets:
+                write_sheet(wb[sheet], sheet_filename(outprefix, sheet))
+        wb.close()
 
 
 def main():
@@ -3,8 +3,8 @@
 
 from __future__ import print_function, division
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import sys, os, json, re
-import dme_utils as dme
 
 # Configuration for defining valid sheets and other default values
 config = {
@@ -13,6 +13,18 @@ config = {
     ".vaults": ["CCBR_Archive", "CCBR_EXT_Archive", "CCR_DTB_Archive"]
 }
 
+# Color escape codes and message tags resolved once at import time
+_ERR_PRE, _ERR_POST = config['.error']
+_WARN_PRE, _WARN_POST = config['.warning']
+_IMP_PRE, _IMP_POST = config['.important']
+_ERROR_TAG = _ERR_PRE + "Error:" + _ERR_POST
+_WARNING_TAG = _WARN_PRE + "Warning:" + _WARN_POST
+
+# Numbers stored as metadata strings, the same syntax float() accepts
+# (i.e. '1', '-1.', '.5', '+1e-3', '1_000', ' inf')
+_DIGITS = r'\d(?:_?\d)*'
+_NUM_RE = re.compile(r'^\s*[-+]?(?:(?:{0}\.?(?:{0})?|\.{0})(?:[eE][-+]?{0})?|inf(?:inity)?|nan)\s*$'.format(_DIGITS), re.IGNORECASE)
+
 def help():
         return """
 validate.py: Validates the entries to be uploaded to DME
@@ -43,7 +55,8 @@ Example:
     $ python validate.py /scratch/DME/ CCBR_EXT_Archive
 
 Requirements:
-    python >= 3.5
+    python >= 3.7
+    httpx[http2]
 """
 
 
@@ -63,7 +76,7 @@ def args(argslist):
 
     # Check to see if user provided input files to parse
     if len(user_args) != 2:
-        print("\n{}Error: Failed to provide all required arguments{}".format(*config['.error']), file=sys.stderr)
+        print("\n{}Error: Failed to provide all required arguments{}".format(_ERR_PRE, _ERR_POST), file=sys.stderr)
         print(help())
         sys.exit(1)
 
@@ -76,8 +89,7 @@ def path_exists(path):
     directories.
     """
     if not os.path.isdir(path):
-        cstart, cend = config['.error']
-        print("{}Error:{} PATH {} not accessible!".format(cstart, cend, path), file=sys.stderr)
+        print("{} PATH {} not accessible!".format(_ERROR_TAG, path), file=sys.stderr)
         sys.exit(1)
     return
 
@@ -91,8 +103,7 @@ def file_exists(filename):
         fh.close()
     # File cannot be opened for reading (may not exist) or permissions problem
     except IOError as e:
-        cstart, cend = config['.error']
-        print("{}Error:{} Failed to open {}... Input file not accessible!\n{}".format(cstart, cend, filename, e), file=sys.stderr)
+        print("{} Failed to open {}... Input file not accessible!\n{}".format(_ERROR_TAG, filename, e), file=sys.stderr)
         sys.exit(1)
     return
 
@@ -113,22 +124,33 @@ def validate_args(user_inputs):
     return ipath, vault
 
 def json2dict(file):
-    """Reads in JSON file into memory as a dictionary. Checks to see if
-    file exists or is accessible before reading in the file.
+    """Reads in JSON file into memory as a dictionary. Raises IOError if the
+    file does not exist or is not accessible, main() reports it and exits.
     """
-    file_exists(file)
-
     with open(file, 'r') as f:
         data = json.load(f)
-
     return data
 
+# Cache of directory listings, each input directory is only scanned once
+_entry_cache = {}
+_META_SUFFIX = '.metadata.json'
+
+def _scan(path):
+    """Returns the (cached) names of the files inside a directory."""
+    if path not in _entry_cache:
+        with os.scandir(path) as it:
+            _entry_cache[path] = [e.name for e in it if e.is_file()]
+    return _entry_cache[path]
+
+def _metadata_files(path, prefix=''):
+    """Returns the metadata JSON files inside a directory starting with prefix."""
+    return [n for n in _scan(path) if n.startswith(prefix) and n.endswith(_META_SUFFIX)]
+
 def get_pi_lab(path):
     """Get the PI_Lab directory address at DME and its metadata."""
-    files = [f for f in os.listdir(path) if 'PI_Lab' in f and '.metadata.json' in f]
-    cstart, cend = config['.error']
+    files = _metadata_files(path, 'PI_Lab')
     if len(files) != 1:
-        print("{}Error:{} Could not find an unique PI_Lab inside the folder {}...".format(cstart, cend, path), file=sys.stderr)
+        print("{} Could not find an unique PI_Lab inside the folder {}...".format(_ERROR_TAG, path), file=sys.stderr)
         sys.exit(1)
 
     directory = path + '/' + files[0].split('.')[0]
@@ -137,10 +159,9 @@ def get_pi_lab(path):
 
 def get_project(path):
     """Get the Project directory address at DME and its metadata."""
-    files = [f for f in os.listdir(path) if 'Project_' in f and '.metadata.json' in f]
-    cstart, cend = config['.error']
+    files = _metadata_files(path, 'Project_')
     if len(files) != 1:
-        print("{}Error:{} Could not find an unique Project inside the folder {}...".format(cstart, cend, path), file=sys.stderr)
+        print("{} Could not find an unique Project inside the folder {}...".format(_ERROR_TAG, path), file=sys.stderr)
         sys.exit(1)
 
     directory = path + '/' + files[0].split('.')[0]
@@ -149,18 +170,17 @@ def get_project(path):
 
 def get_analysis_objects(path):
     """Get the Analysis object addresses at DME and their metadata."""
-    files = [f for f in os.listdir(path) if '.metadata.json' in f]
+    files = _metadata_files(path)
     #directories = [path + '/' + f.split('.')[0] for f in files]
-    directories = [path + '/' + f.split('.metadata.json')[0] for f in files]
+    directories = [path + '/' + f[:-len(_META_SUFFIX)] for f in files]
     metas = [json2dict(f"{path}/{f}") for f in files]
     return metas, directories
 
 def get_analysis(path):
     """Get the Primary Analysis directory address at DME and its metadata."""
-    files = [f for f in os.listdir(path) if 'Primary_Analysis_' in f and '.metadata.json' in f]
-    cstart, cend = config['.error']
+    files = _metadata_files(path, 'Primary_Analysis_')
     if len(files) != 1:
-        print("{}Error:{} Could not find an unique Project inside the folder {}...".format(cstart, cend, path), file=sys.stderr)
+        print("{} Could not find an unique Project inside the folder {}...".format(_ERROR_TAG, path), file=sys.stderr)
         sys.exit(1)
 
     directory = path + '/' + files[0].split('.')[0]
@@ -170,15 +190,15 @@ def get_analysis(path):
 
 def get_sample_objects(path):
     """Get the Sample object addresses at DME and their metadata."""
-    files = [f for f in os.listdir(path) if '.metadata.json' in f]
+    files = _metadata_files(path)
     #directories = [path + '/' + f.split('.')[0] for f in files]
-    directories = [path + '/' + f.split('.metadata.json')[0] for f in files]
+    directories = [path + '/' + f[:-len(_META_SUFFIX)] for f in files]
     metas = [json2dict(f"{path}/{f}") for f in files]
     return metas, directories
 
 def get_samples(path):
     """Get the Sample directory address at DME and their metadata."""
-    files = [f for f in os.listdir(path) if 'Sample_' in f and '.metadata.json' in f]
+    files = _metadata_files(path, 'Sample_')
     directories = [path + '/' + f.split('.')[0] for f in files]
     metas = [json2dict(f"{path}/{f}") for f in files]
     objs = [get_sample_objects(d) for d in directories]
@@ -194,130 +214,160 @@ def get_dme_directory(full_path,initial_path,vault):
         path = '/' + path
     return path
 
-def get_different_fields(meta_dme,meta_local):
+def attribute_map(meta):
+    """Convert a list of metadata entries into an attribute -> value dictionary."""
+    return {e['attribute']: e['value'] for e in meta}
+
+def metadata_map(meta):
+    """Returns the attribute -> value dictionary of a metadata dictionary. It is
+    only built when an object is compared, the loaded metadata is left untouched."""
+    return attribute_map(meta['metadataEntries'])
+
+def is_number(value):
+    """Checks if a metadata value is a number or a string holding a number."""
+    if isinstance(value, (int, float)):
+        return True
+    return isinstance(value, str) and _NUM_RE.match(value) is not None
+
+def values_equal(a, b):
+    """Compares two metadata values, numbers are compared by value (i.e. '1' and '1.0').
+    Non-numeric strings are detected up front instead of failing on float()."""
+    if a == b:
+        return True
+    if is_number(a) and is_number(b):
+        return float(a) == float(b)
+    return False
+
+def get_different_fields(dme_map,local_map):
     """Evaluate which fields exists already on DME, which ones exists only locally
-    and which of them are in both places."""
-    #print(meta_dme,meta_local)
-    items_only_dme = []
-    items_only_local = []
-    items_both = []
-    for i in range(len(meta_dme)):
-        att_i = meta_dme[i]['attribute']
-        has_attribute = False
-        for j in range(len(meta_local)):
-            att_j = meta_local[j]['attribute']
-            if att_i == att_j:
-                items_both.append(att_i)
-                has_attribute = True
-        if not has_attribute:
-            items_only_dme.append(att_i)
-    for i in range(len(meta_local)):
-        att_i = meta_local[i]['attribute']
-        has_attribute = False
-        for j in range(len(meta_dme)):
-            att_j = meta_dme[j]['attribute']
-            if att_i == att_j:
-                has_attribute = True
-        if not has_attribute:
-            items_only_local.append(att_i)
+    and which of them are in both places. Takes attribute -> value dictionaries."""
+    # Keep DME/local ordering in the reports instead of arbitrary set ordering
+    items_only_dme = [att for att in dme_map if att not in local_map]
+    items_only_local = [att for att in local_map if att not in dme_map]
+    items_both = [att for att in dme_map if att in local_map]
     return items_only_dme, items_only_local, items_both
 
-def evaluate_differences(meta_dme,meta_local):
-    """Print the differences between existing metadata and the ones that will replace."""
-    items_only_dme, items_only_local, items_both = get_different_fields(meta_dme,meta_local)
+def evaluate_differences(dme_map,local_map):
+    """Print the differences between existing metadata and the ones that will replace.
+    Takes attribute -> value dictionaries."""
+    items_only_dme, items_only_local, items_both = get_different_fields(dme_map,local_map)
     print(f"   There are:\n   > {len(items_only_dme)} attributes only on DME\n   > {len(items_only_local)} attributes to be appended\n   > {len(items_both)} attributes in both lists.")
-    for att_i in items_only_local:
-        for i in range(len(meta_local)):
-            att = meta_local[i]['attribute']
-            if (att == att_i):
-                print(f"   ! The attribute \'{att}\' will be appended with value as \'{meta_local[i]['value']}\'")
+    for att in items_only_local:
+        print(f"   ! The attribute \'{att}\' will be appended with value as \'{local_map[att]}\'")
     for att in items_both:
-        for i in range(len(meta_local)):
-            att_i = meta_local[i]['attribute']
-            if att != att_i:
-                continue
-            for j in range(len(meta_dme)):
-                att_j = meta_dme[j]['attribute']
-                if att != att_j:
-                    continue
-                
-                if meta_local[i]['value'] != meta_dme[j]['value']:
-                    try:
-                        if float(meta_local[i]['value']) != float(meta_dme[j]['value']):
-                            print(f"   ! The attribute \'{att}\' will be modified from \'{meta_dme[j]['value']}\' to \'{meta_local[i]['value']}\'")
-                    except:
-                        print(f"   ! The attribute \'{att}\' will be modified from \'{meta_dme[j]['value']}\' to \'{meta_local[i]['value']}\'")
-
-def evaluate_metadata_differences(session,meta_dir,meta,level="",is_collection=False):
-    """Evaluate the differences between existing metadata and the ones that will replace."""
+        local_value, dme_value = local_map[att], dme_map[att]
+        if not values_equal(local_value, dme_value):
+            print(f"   ! The attribute \'{att}\' will be modified from \'{dme_value}\' to \'{local_value}\'")
+
+def get_dme_meta(session,meta_dir,is_collection=False):
+    """Fetch the metadata of a collection or DataObject as it is stored on DME.
+    Returns the metadata and the error message of a failed request, which is
+    not printed here since the fetches may run ahead of the report."""
     if is_collection:
-        meta_dme = session.get_collection_dme_meta(meta_dir,in_pairs=False)
-    else:
-        meta_dme = session.get_dataObject_dme_meta(meta_dir,in_pairs=False)
-
+        return session.get_collection_dme_meta(meta_dir,in_pairs=False,return_error=True)
+    return session.get_dataObject_dme_meta(meta_dir,in_pairs=False,return_error=True)
+
+def get_dme_metas(session,meta_dirs,is_collection=False,max_workers=16):
+    """Fetch the DME metadata of several collections or DataObjects concurrently.
+    The requests are network bound, so a thread pool sharing the session's
+    connection pool overlaps them. Returns (metadata, error) tuples in the order of meta_dirs."""
+    if len(meta_dirs) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return list(ex.map(lambda d: get_dme_meta(session,d,is_collection), meta_dirs))
+
+def compare_metadata(meta_dme,meta,level="",error=""):
+    """Print the differences between the metadata fetched from DME and the local one.
+    The error message of the DME request, if any, is printed before the report."""
+    if error:
+        print(error)
     if len(meta_dme) == 0:
         print(f"{level} does not exist on DME!")
         return False
 
-    print("{}Warning:{} {} already exists on DME!".format(*config['.warning'], level), file=sys.stderr)
-    evaluate_differences(meta_dme['metadataEntries'],meta['metadataEntries'])
+    print("{} {} already exists on DME!".format(_WARNING_TAG, level), file=sys.stderr)
+    evaluate_differences(metadata_map(meta_dme),metadata_map(meta))
     return True
 
+def evaluate_metadata_differences(session,meta_dir,meta,level="",is_collection=False):
+    """Evaluate the differences between existing metadata and the ones that will replace."""
+    meta_dme, error = get_dme_meta(session,meta_dir,is_collection)
+    return compare_metadata(meta_dme,meta,level,error)
+
 def main():
 
     print("\n\n###### VALIDATION STEP #####\n")
     # @args(): Parses positional command-line args
     # @validate_args(): Checks if user inputs are vaild
     ipath, vault = validate_args(args(sys.argv))
+    # Imported here so the help and argument errors do not load the HTTP stack
+    import dme_utils as dme
 
     # Read in JSON files as dictionary
-    pi_meta, pi_dir = get_pi_lab(ipath)
-    proj_meta, proj_dir = get_project(pi_dir)
-    analysis_meta, analysis_dir, analysis_objs, analysis_objs_dir = get_analysis(proj_dir)
-    samples_meta, samples_dir, sample_objs, sample_objs_dir = get_samples(proj_dir)
+    try:
+        pi_meta, pi_dir = get_pi_lab(ipath)
+        proj_meta, proj_dir = get_project(pi_dir)
+        analysis_meta, analysis_dir, analysis_objs, analysis_objs_dir = get_analysis(proj_dir)
+        samples_meta, samples_dir, sample_objs, sample_objs_dir = get_samples(proj_dir)
+    # File cannot be opened for reading (may not exist) or permissions problem
+    except IOError as e:
+        print("{} Failed to open {}... Input file not accessible!\n{}".format(_ERROR_TAG, e.filename, e), file=sys.stderr)
+        sys.exit(1)
     
     # Create DME Session
     dme_session = dme.DMESession()
     print(f"DME session URL: {dme_session.dme_url}")
 
     # Evaluate the existence of the project at the DME and the differences between meta to be added and already in DME
-    ci, cf = config['.important']
     # PI_Lab level
-    print(f"\n{ci} - PI_Lab level: {pi_dir.split('/')[-1]}{cf}")
+    print(f"\n{_IMP_PRE} - PI_Lab level: {pi_dir.split('/')[-1]}{_IMP_POST}")
     pi_dir_dme = get_dme_directory(pi_dir,ipath,vault)
     pi_exists = evaluate_metadata_differences(dme_session,pi_dir_dme,pi_meta,"PI_Lab",True)
     
     if (pi_exists):
         # Project level
-        print(f"\n{ci} - Project level: {proj_dir.split('/')[-1]}{cf}")
+        print(f"\n{_IMP_PRE} - Project level: {proj_dir.split('/')[-1]}{_IMP_POST}")
         proj_dir_dme = get_dme_directory(proj_dir,ipath,vault)
         proj_exists = evaluate_metadata_differences(dme_session,proj_dir_dme,proj_meta,"Project",True)
 
         if (proj_exists):
             # Primary Analysis level
-            print(f"\n{ci} - Primary Analysis level: {analysis_dir.split('/')[-1]}{cf}")
             analysis_dir_dme = get_dme_directory(analysis_dir,ipath,vault)
-            analysis_exists = evaluate_metadata_differences(dme_session,analysis_dir_dme,analysis_meta,"Primary Analysis",True)
+            analysis_meta_dme, analysis_error = get_dme_meta(dme_session,analysis_dir_dme,True)
+            samples_dir_dme = [get_dme_directory(d,ipath,vault) for d in samples_dir]
+            samples_meta_dme = get_dme_metas(dme_session,samples_dir_dme,True)
+
+            # Fetch the DataObjects of every existing collection at once
+            objs_dir_dme = []
+            if len(analysis_meta_dme) != 0:
+                objs_dir_dme += [get_dme_directory(d,ipath,vault) for d in analysis_objs_dir]
+            for i in range(len(samples_meta)):
+                if len(samples_meta_dme[i][0]) != 0:
+                    objs_dir_dme += [get_dme_directory(d,ipath,vault) for d in sample_objs_dir[i]]
+            objs_meta_dme = iter(get_dme_metas(dme_session,objs_dir_dme,False))
+
+            print(f"\n{_IMP_PRE} - Primary Analysis level: {analysis_dir.split('/')[-1]}{_IMP_POST}")
+            analysis_exists = compare_metadata(analysis_meta_dme,analysis_meta,"Primary Analysis",analysis_error)
 
             if (analysis_exists):
                 # Data Objects
                 for i in range(len(analysis_objs)):
                     print(f" * Data Object {analysis_objs_dir[i].split('/')[-1]}:")
-                    obj_dir_dme = get_dme_directory(analysis_objs_dir[i],ipath,vault)
-                    sample_exists = evaluate_metadata_differences(dme_session,obj_dir_dme,analysis_objs[i],"DataObject",False)
+                    obj_meta_dme, obj_error = next(objs_meta_dme)
+                    obj_exists = compare_metadata(obj_meta_dme,analysis_objs[i],"DataObject",obj_error)
             
             # Sample level
             for i in range(len(samples_meta)):
-                print(f"\n{ci} - Sample level: {samples_dir[i].split('/')[-1]}{cf}")
-                sample_dir_dme = get_dme_directory(samples_dir[i],ipath,vault)
-                sample_exists = evaluate_metadata_differences(dme_session,sample_dir_dme,samples_meta[i],"Sample",True)
+                print(f"\n{_IMP_PRE} - Sample level: {samples_dir[i].split('/')[-1]}{_IMP_POST}")
+                sample_meta_dme, sample_error = samples_meta_dme[i]
+                sample_exists = compare_metadata(sample_meta_dme,samples_meta[i],"Sample",sample_error)
 
                 if (sample_exists):
                     # Data Objects
                     for j in range(len(sample_objs[i])):
                         print(f" * Data Object {sample_objs_dir[i][j].split('/')[-1]}:")
-                        obj_dir_dme = get_dme_directory(sample_objs_dir[i][j],ipath,vault)
-                        obj_exists = evaluate_metadata_differences(dme_session,obj_dir_dme,sample_objs[i][j],"DataObject",False)
+                        obj_meta_dme, obj_error = next(objs_meta_dme)
+                        obj_exists = compare_metadata(obj_meta_dme,sample_objs[i][j],"DataObject",obj_error)
     
 
 if __name__ == '__main__':
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import contextlib, io, json, os, sys, unittest
+from unittest import mock
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import dme_utils
+
+
+class TestDMESessionCache(unittest.TestCase):
+    """Tests for the metadata cache of dme_utils.DMESession"""
+
+    def setUp(self):
+        # No request is sent, the fetches are replaced below
+        self.session = dme_utils.DMESession(dme_url='https://localhost', dme_token='token', cache_ttl=300, cache_size=2)
+        self.fetched = []
+        self.session._fetch_collection_dme_meta = self.fetch
+        self.session._fetch_dataObject_dme_meta = self.fetch
+
+    def tearDown(self):
+        self.session._client.close()
+
+    def fetch(self, path, in_pairs=True):
+        """Stands in for a DME request, paths starting with 'missing' fail."""
+        self.fetched.append(path)
+        if path.startswith('missing'):
+            return {}, "Response code: 404, Response message: not found"
+        return {'path': path, 'in_pairs': in_pairs}, ''
+
+    def test_cached_within_ttl(self):
+        first = self.session.get_collection_dme_meta('a')
+        second = self.session.get_collection_dme_meta('a')
+        self.assertEqual(first, {'path': 'a', 'in_pairs': True})
+        self.assertIs(first, second)
+        self.assertEqual(self.fetched, ['a'])
+
+    def test_keys(self):
+        self.session.get_collection_dme_meta('a')
+        self.session.get_collection_dme_meta('a', in_pairs=False)
+        self.session.get_dataObject_dme_meta('a')
+        self.assertEqual(self.fetched, ['a', 'a', 'a'])
+
+    def test_expiry(self):
+        with mock.patch('dme_utils.time') as fake_time:
+            fake_time.monotonic.return_value = 1000.0
+            self.session.get_collection_dme_meta('a')
+            fake_time.monotonic.return_value = 1300.0
+            self.session.get_collection_dme_meta('a')
+            self.assertEqual(self.fetched, ['a'])
+            fake_time.monotonic.return_value = 1300.1
+            self.session.get_collection_dme_meta('a')
+            self.assertEqual(self.fetched, ['a', 'a'])
+
+    def test_lru_eviction(self):
+        self.session.get_collection_dme_meta('a')
+        self.session.get_collection_dme_meta('b')
+        # Using 'a' again makes 'b' the least recently used entry
+        self.session.get_collection_dme_meta('a')
+        self.session.get_collection_dme_meta('c')
+        self.assertEqual(len(self.session._cache), 2)
+        self.session.get_collection_dme_meta('a')
+        self.assertEqual(self.fetched, ['a', 'b', 'c'])
+        self.session.get_collection_dme_meta('b')
+        self.assertEqual(self.fetched, ['a', 'b', 'c', 'b'])
+
+    def test_invalidate_path(self):
+        self.session.get_collection_dme_meta('a')
+        self.session.get_collection_dme_meta('a', in_pairs=False)
+        self.session.invalidate('a')
+        self.assertEqual(len(self.session._cache), 0)
+        self.session.get_collection_dme_meta('a')
+        self.session.get_dataObject_dme_meta('b')
+        self.session.invalidate('b')
+        self.session.get_collection_dme_meta('a')
+        self.session.get_dataObject_dme_meta('b')
+        self.assertEqual(self.fetched, ['a', 'a', 'a', 'b', 'b'])
+
+    def test_invalidate_all(self):
+        self.session.get_collection_dme_meta('a')
+        self.session.get_dataObject_dme_meta('b')
+        self.session.invalidate()
+        self.session.get_collection_dme_meta('a')
+        self.session.get_dataObject_dme_meta('b')
+        self.assertEqual(self.fetched, ['a', 'b', 'a', 'b'])
+
+    def test_errors_not_cached(self):
+        meta, error = self.session.get_dataObject_dme_meta('missing', return_error=True)
+        self.assertEqual(meta, {})
+        self.assertEqual(error, "Response code: 404, Response message: not found")
+        self.session.get_dataObject_dme_meta('missing', return_error=True)
+        self.assertEqual(self.fetched, ['missing', 'missing'])
+        self.assertEqual(self.session.get_dataObject_dme_meta('b', return_error=True), ({'path': 'b', 'in_pairs': True}, ''))
+
+
+class Body():
+    """Response body served in chunks, records how many chunks were sent."""
+
+    def __init__(self, data, size):
+        self.chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.sent += 1
+            yield chunk
+
+
+def collection(paths, entries=None):
+    """Builds a DME collection response."""
+    return {'collections': [{
+        'metadataEntries': {'selfMetadataEntries': entries or [], 'parentMetadataEntries': []},
+        'collection': {'dataObjects': [{'path': p} for p in paths]}
+    }]}
+
+
+def data_object(entries):
+    """Builds a DME dataObject response."""
+    return {'metadataEntries': {'selfMetadataEntries': [{'userMetadataEntries': entries, 'systemMetadataEntries': []}]}}
+
+
+class TestStreaming(unittest.TestCase):
+    """Tests for the streamed JSON responses of dme_utils.DMESession"""
+
+    def setUp(self):
+        self.session = dme_utils.DMESession(dme_url='https://localhost', dme_token='token')
+        self.session._client.close()
+        self.responses = {}
+        self.bodies = []
+        self.session._client = httpx.Client(transport=httpx.MockTransport(self.handle))
+        # Small read buffer so every response is parsed in several chunks
+        patcher = mock.patch.object(dme_utils, 'STREAM_CHUNK_SIZE', 16)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.session._client.close()
+
+    def handle(self, request):
+        """Serves the responses registered for a path, 404 otherwise."""
+        if request.url.path not in self.responses:
+            return httpx.Response(404, content=b'not found')
+        body = Body(json.dumps(self.responses[request.url.path]).encode(), 16)
+        self.bodies.append(body)
+        return httpx.Response(200, content=body)
+
+    def stream(self, data, prefix, first=False):
+        """Streams data from the mock transport through the helpers."""
+        self.responses['/doc'] = data
+        with self.session._client.stream('GET', 'https://localhost/doc') as response:
+            if first:
+                return dme_utils.first_json_item(response, prefix)
+            return list(dme_utils.stream_json_items(response, prefix))
+
+    def test_stream_items(self):
+        data = collection(['/a/%d' % i for i in range(20)])
+        items = self.stream(data, 'collections.item.collection.dataObjects.item')
+        self.assertEqual(items, data['collections'][0]['collection']['dataObjects'])
+        self.assertGreater(len(self.bodies[0].chunks), 1)
+
+    def test_numbers_are_floats(self):
+        self.assertEqual(self.stream({'values': [1.5, 2]}, 'values.item'), [1.5, 2])
+        self.assertIsInstance(self.stream({'values': [1.5]}, 'values.item')[0], float)
+
+    def test_missing_key(self):
+        self.assertEqual(self.stream({'other': [1, 2]}, 'collections.item'), [])
+        self.assertIsNone(self.stream({'other': [1, 2]}, 'collections.item', first=True))
+        self.assertEqual(self.bodies[-1].sent, len(self.bodies[-1].chunks))
+
+    def test_early_close_drains_body(self):
+        data = collection(['/a/%d' % i for i in range(50)], [{'attribute': 'a', 'value': '1'}])
+        first = self.stream(data, 'collections.item.metadataEntries', first=True)
+        self.assertEqual(first['selfMetadataEntries'], [{'attribute': 'a', 'value': '1'}])
+        body = self.bodies[0]
+        self.assertGreater(len(body.chunks), 10)
+        self.assertEqual(body.sent, len(body.chunks))
+
+    def test_collection_meta(self):
+        self.responses['/collection/C'] = collection(['/C/x'], [{'attribute': 'a', 'value': '1'}])
+        self.assertEqual(self.session.get_collection_dme_meta('/C'), {'a': '1'})
+        self.assertEqual(self.session.get_collection_dme_meta('/C', in_pairs=False),
+                         {'metadataEntries': [{'attribute': 'a', 'value': '1'}]})
+
+    def test_data_object_meta(self):
+        self.responses['/v2/dataObject/C/x'] = data_object([{'attribute': 'b', 'value': '2'}])
+        self.assertEqual(self.session.get_dataObject_dme_meta('C/x', return_error=True), ({'b': '2'}, ''))
+
+    def test_no_metadata_found(self):
+        self.responses['/v2/dataObject/C/x'] = {'metadataEntries': {'selfMetadataEntries': []}}
+        self.responses['/collection/C'] = {'collections': []}
+        self.assertEqual(self.session.get_dataObject_dme_meta('C/x', return_error=True),
+                         ({}, "Response code: 200, Response message: no dataObject metadata found for C/x"))
+        self.assertEqual(self.session.get_collection_dme_meta('/C', return_error=True),
+                         ({}, "Response code: 200, Response message: no collection metadata found for /C"))
+
+    def test_request_error(self):
+        self.assertEqual(self.session.get_dataObject_dme_meta('C/missing', return_error=True),
+                         ({}, "Response code: 404, Response message: not found"))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(self.session.get_dataObject_dme_meta('C/missing'), {})
+        self.assertEqual(out.getvalue(), "Response code: 404, Response message: not found\n")
+
+    def test_list_files(self):
+        self.responses['/collection/C'] = collection(['/C/x', '/C/y'])
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(self.session.list_files('C'), ['/C/x', '/C/y'])
+        self.assertEqual(out.getvalue(), '')
+
+    def test_list_files_print(self):
+        self.responses['/collection/C'] = collection(['/C/x', '/C/y'])
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(self.session.list_files('C', print_dataObjects=True), ['/C/x', '/C/y'])
+        self.assertEqual(out.getvalue(), json.dumps([{'path': '/C/x'}, {'path': '/C/y'}], indent=2, separators=(", ", " = ")) + '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
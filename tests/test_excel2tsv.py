@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import excel2tsv
+
+from openpyxl import Workbook
+from openpyxl.styles import Font
+
+
+class TestWriteSheet(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def convert(self, wb):
+        """Saves the workbook and converts its first worksheet, returns the TSV text."""
+        xlsx = os.path.join(self.tmpdir, 'test.xlsx')
+        wb.save(xlsx)
+        excel2tsv.write(xlsx, os.path.join(self.tmpdir, 'out'))
+        with open(os.path.join(self.tmpdir, 'out_Sheet.txt'), encoding='utf-8', newline='') as fh:
+            return fh.read()
+
+    def workbook(self, *rows):
+        wb = Workbook()
+        ws = wb.active
+        ws.title = 'Sheet'
+        for row in rows:
+            ws.append(row)
+        return wb
+
+    def test_plain_sheet(self):
+        text = self.convert(self.workbook(['a', 'b'], ['c', 1]))
+        self.assertEqual(text, 'a\tb\nc\t1\n')
+
+    def test_trailing_empty_rows_are_dropped(self):
+        wb = self.workbook(['a', 'b'], [None, None], ['c', 'd'])
+        wb.active['B10'].font = Font(bold=True)
+        self.assertEqual(self.convert(wb), 'a\tb\n\t\nc\td\n')
+
+    def test_trailing_empty_columns_are_trimmed(self):
+        wb = self.workbook(['a', 'b'], ['c'], [None, None], ['d', 'multi\nline\tcell'])
+        wb.active['F12'].font = Font(bold=True)
+        self.assertEqual(self.convert(wb), 'a\tb\nc\t\n\t\nd\t"multi\nline\tcell"\n')
+
+    def test_no_temporary_file_left(self):
+        wb = self.workbook(['a'])
+        wb.active['C3'].font = Font(bold=True)
+        self.convert(wb)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['out_Sheet.txt', 'test.xlsx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import json, os, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import validate
+
+
+def float_equal(a, b):
+    """Reference behaviour: the float() comparison validate.py used before."""
+    try:
+        return float(a) == float(b)
+    except ValueError:
+        return False
+
+
+def entries(*attributes):
+    """Builds DME style metadata entries, values are the attribute names in upper case."""
+    return [{'attribute': att, 'value': att.upper()} for att in attributes]
+
+
+class TestDifferentFields(unittest.TestCase):
+    """Tests for splitting the attributes of DME and local metadata in validate.py"""
+
+    def test_order_and_contents(self):
+        dme_map = validate.attribute_map(entries('d', 'a', 'x', 'b'))
+        local_map = validate.attribute_map(entries('b', 'n', 'a', 'm'))
+        only_dme, only_local, both = validate.get_different_fields(dme_map, local_map)
+        self.assertEqual(only_dme, ['d', 'x'])
+        self.assertEqual(only_local, ['n', 'm'])
+        # Attributes in both places keep the DME order
+        self.assertEqual(both, ['a', 'b'])
+
+    def test_disjoint_and_empty(self):
+        self.assertEqual(validate.get_different_fields({'a': 1}, {'b': 2}), (['a'], ['b'], []))
+        self.assertEqual(validate.get_different_fields({}, {'b': 2}), ([], ['b'], []))
+        self.assertEqual(validate.get_different_fields({'a': 1}, {'a': 2}), ([], [], ['a']))
+
+    def test_metadata_map(self):
+        meta = {'metadataEntries': entries('a', 'b')}
+        self.assertEqual(validate.metadata_map(meta), {'a': 'A', 'b': 'B'})
+        self.assertEqual(meta, {'metadataEntries': entries('a', 'b')})
+
+    def test_json2dict_untouched(self):
+        meta = {'metadataEntries': 'malformed', 'other': [1, 2]}
+        with tempfile.NamedTemporaryFile('w', suffix='.metadata.json', delete=False) as f:
+            json.dump(meta, f)
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(validate.json2dict(f.name), meta)
+        self.assertRaises(IOError, validate.json2dict, f.name + '.missing')
+
+
+class TestValuesEqual(unittest.TestCase):
+    """Tests for comparing metadata values in validate.py"""
+
+    def test_same_value(self):
+        self.assertTrue(validate.values_equal('RNA-seq', 'RNA-seq'))
+        self.assertTrue(validate.values_equal('nan', 'nan'))
+
+    def test_different_strings(self):
+        self.assertFalse(validate.values_equal('RNA-seq', 'ChIP-seq'))
+        self.assertFalse(validate.values_equal('abc', '1'))
+        self.assertFalse(validate.values_equal('1E5.', '100000'))
+
+    def test_numbers(self):
+        pairs = [('1', '1.0'), ('.5', '0.5'), ('1.', '1'), ('+1', '1'), ('-0.5', '-.5'),
+                 ('1e3', '1000'), ('1E-3', '0.001'), (' 2', '2'), ('1_000', '1000'),
+                 ('inf', 'Infinity'), (2, '2.0'), (0.5, '.5')]
+        for a, b in pairs:
+            self.assertTrue(validate.values_equal(a, b), (a, b))
+        self.assertFalse(validate.values_equal('-3', '-3.1'))
+        self.assertFalse(validate.values_equal('nan', 'NaN'))
+
+    def test_matches_float(self):
+        values = ['1', '1.0', '.5', '0.5', '1.', '+1', '-1', '1e5', '1E5', '1e+5', '1E5.', '-.5e-2',
+                  '1_0', '10', '_1', '1__0', 'inf', '-Infinity', 'nan', 'e5', '.', '-', '', 'abc', '1,5']
+        for a in values:
+            for b in values:
+                self.assertEqual(validate.values_equal(a, b), a == b or float_equal(a, b), (a, b))
+
+
+if __name__ == '__main__':
+    unittest.main()